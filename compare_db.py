@@ -1,6 +1,7 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
-from sqlalchemy import select
+from sqlalchemy import distinct, func, select
 
 from medicover_aws import db, utils
 
@@ -40,6 +41,40 @@ col_to_check = [
 ]
 
 
+def fetch_all_distinct(session, table, cols: list) -> dict:
+    """Get the distinct values of the given columns of a table
+
+    Parameters
+    ----------
+    session : SQLAlchemy session object
+        Session object for the connected database
+    table : SQLAlchemy Table object
+        Table object to get the values from
+    cols : list
+        List of column names to get the values of
+
+    Returns
+    -------
+    dict
+        Dict of column names to the set of their values as strings
+    """
+
+    # aggregate the distinct values of every column in postgres so that only
+    # one row of arrays is sent back
+    query = select(
+        *[func.array_agg(distinct(table.c[col])).label(col) for col in cols]
+    )
+    row = session.execute(query).mappings().one()
+
+    data = {}
+
+    for col in cols:
+        # array_agg returns NULL rather than an empty array for an empty table
+        data[col] = {str(value) for value in row[col] or []}
+
+    return data
+
+
 def main(config_dev, config_prod):
     dev_db_creds = utils.parse_json(config_dev)
     prod_db_creds = utils.parse_json(config_prod)
@@ -49,27 +84,22 @@ def main(config_dev, config_prod):
     dev_inca_table = dev_meta.tables["testdirectory.inca"]
     prod_inca_table = prod_meta.tables["testdirectory.inca"]
 
-    data = {"dev": {}, "prod": {}}
-
-    for col in dev_inca_table.c:
-        data["dev"][col.name] = list(
-            set(dev_session.execute(select(col)).all())
+    # both databases are independent so query them at the same time
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        dev_future = executor.submit(
+            fetch_all_distinct, dev_session, dev_inca_table, col_to_check
         )
-
-    for col in prod_inca_table.c:
-        data["prod"][col.name] = list(
-            set(prod_session.execute(select(col)).all())
+        prod_future = executor.submit(
+            fetch_all_distinct, prod_session, prod_inca_table, col_to_check
         )
 
+        data = {"dev": dev_future.result(), "prod": prod_future.result()}
+
     cols = []
 
     for col in col_to_check:
-        dev_values = set(
-            sorted([str(value) for ele in data["dev"][col] for value in ele])
-        )
-        prod_values = set(
-            sorted([str(value) for ele in data["prod"][col] for value in ele])
-        )
+        dev_values = data["dev"][col]
+        prod_values = data["prod"][col]
 
         cols.append(
             (
@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine, insert
+from psycopg import sql
+from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql.schema import MetaData
 
@@ -19,11 +20,11 @@ def connect_to_db(creds: dict):
 
     # Create SQLAlchemy engine to connect to AWS database
     url = (
-        "postgresql+psycopg2://"
+        "postgresql+psycopg://"
         f"{creds['user']}:{creds['pwd']}@{creds['endpoint']}:{creds['port']}/ngtd"
     )
 
-    engine = create_engine(url)
+    engine = create_engine(url, insertmanyvalues_page_size=1000)
 
     meta = MetaData(schema="testdirectory")
     meta.reflect(bind=engine)
@@ -33,6 +34,38 @@ def connect_to_db(creds: dict):
     return session, meta
 
 
+def copy_in_db(session, table, data):
+    """Load the data in the database using the COPY protocol of postgres
+
+    Parameters
+    ----------
+    session : SQLAlchemy session object
+        Session object for the connected database
+    table : SQLAlchemy Table object
+        Table object in which the data will be imported to
+    data : pl.DataFrame
+        Dataframe of the data that needs to be imported in the database,
+        the columns need to match the table's
+    """
+
+    if data.is_empty():
+        return
+
+    copy_query = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(table.schema, table.name),
+        sql.SQL(", ").join(sql.Identifier(column) for column in data.columns),
+    )
+
+    # psycopg connection underneath the SQLAlchemy session
+    driver_connection = session.connection().connection.driver_connection
+
+    with driver_connection.cursor() as cursor:
+        with cursor.copy(copy_query) as copy:
+            # rows come out of the dataframe as tuples in the column order
+            for row in data.iter_rows():
+                copy.write_row(row)
+
+
 def insert_in_db(session, table, data):
     """Insert the data in the database
 
@@ -42,10 +75,10 @@ def insert_in_db(session, table, data):
         Session object for the connected database
     table : SQLAlchemy Table object
         Table object in which the data will be imported to
-    data : list
-        List of dict that need to be imported in the database
+    data : pl.DataFrame
+        Dataframe of the data that needs to be imported in the database
     """
 
-    insert_obj = insert(table).values(data)
-    session.execute(insert_obj)
+    # COPY is much faster than inserts for bulk loading in postgres
+    copy_in_db(session, table, data)
     session.commit()
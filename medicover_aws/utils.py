@@ -1,9 +1,18 @@
+import ast
+import functools
 import itertools
 import json
+import re
 
+import jq
+import orjson
 import polars as pl
 
 
+# jq queries that only access object keys i.e. ".variant.chr"
+SIMPLE_PATH_REGEX = re.compile(r"(\.[A-Za-z_][A-Za-z0-9_]*)+")
+
+
 def parse_json(json_file: str):
     """Parse a JSON file
 
@@ -18,8 +27,8 @@ def parse_json(json_file: str):
         Dict containing the JSON data
     """
 
-    with open(json_file) as f:
-        data = json.loads(f.read())
+    with open(json_file, "rb") as f:
+        data = orjson.loads(f.read())
 
     return data
 
@@ -38,7 +47,8 @@ def parse_xlsx(xlsx_file: str) -> pl.DataFrame:
         Dataframe that resulted in parsing
     """
 
-    df = pl.read_excel(xlsx_file)
+    # only the sample numbers and panels are used from the manifest
+    df = pl.read_excel(xlsx_file, columns=["CUH sample number", "Panels"])
     df = df.with_columns(Panels=pl.col("Panels").str.split(";"))
     return df
 
@@ -72,6 +82,237 @@ def parse_tsv(tsv_file: str, *keys) -> list:
     return data
 
 
+def parse_panelapp_dump(tsv_file: str) -> list:
+    """Parse the Panelapp dump TSV file
+
+    Parameters
+    ----------
+    tsv_file : str
+        Path to the Panelapp dump file
+
+    Returns
+    -------
+    list
+        List of dicts for the panels with the relevant disorders parsed into
+        a list
+    """
+
+    panelapp_dump = parse_tsv(tsv_file, "id", "name", "relevant_disorders")
+
+    for panel_data in panelapp_dump:
+        # the relevant disorders are stored as a Python list literal
+        panel_data["relevant_disorders"] = ast.literal_eval(
+            panel_data["relevant_disorders"]
+        )
+
+    return panelapp_dump
+
+
+def get_queries(structure_mapping: dict, *excluded_keys) -> set:
+    """Get the queries present in the mapping of a report structure
+
+    Parameters
+    ----------
+    structure_mapping : dict
+        Dict containing the mapping between the report fields and the db
+        columns for a report structure
+    excluded_keys : str
+        Keys of the mapping to ignore
+
+    Returns
+    -------
+    set
+        Set of queries
+    """
+
+    queries = set()
+
+    for key, value in structure_mapping.items():
+        if key in excluded_keys:
+            continue
+
+        # the queries can be stored in the keys, the values, a list of
+        # queries or the keys of a dict depending on the field
+        candidates = [key]
+
+        if isinstance(value, str):
+            candidates.append(value)
+        else:
+            candidates.extend(value)
+
+        # other strings are db column names or placeholders
+        queries.update(
+            candidate for candidate in candidates if candidate.startswith(".")
+        )
+
+    return queries
+
+
+def compile_queries(mapping: dict, *extra_queries) -> dict:
+    """Compile every query present in the mapping once so that they can be
+    reused for every variant. Queries that only access object keys are
+    converted to a tuple of keys, the others are compiled with jq
+
+    Parameters
+    ----------
+    mapping : dict
+        Dict containing the mapping between the report fields and the db
+        columns for every report structure
+    extra_queries : str
+        Additional jq queries used outside of the mapping
+
+    Returns
+    -------
+    dict
+        Dict of queries to their tuple of keys or compiled jq program
+    """
+
+    queries = set(extra_queries)
+
+    for structure_mapping in mapping.values():
+        queries.update(get_queries(structure_mapping))
+
+    compiled_queries = {}
+
+    for query in queries:
+        if SIMPLE_PATH_REGEX.fullmatch(query):
+            compiled_queries[query] = tuple(query.split(".")[1:])
+        else:
+            compiled_queries[query] = jq.compile(query)
+
+    return compiled_queries
+
+
+def get_path(data, path: tuple):
+    """Get the value at the given path of keys, mimicking jq by returning
+    None if a key is missing
+
+    Parameters
+    ----------
+    data : dict
+        Dict to get the value from
+    path : tuple
+        Tuple of the keys to follow
+
+    Returns
+    -------
+    Any
+        Value found at the end of the path
+    """
+
+    for key in path:
+        if data is None:
+            return None
+
+        data = data.get(key)
+
+    return data
+
+
+def combine_jq_queries(compiled_queries: dict, queries: set):
+    """Combine the queries that need jq in a single jq program outputting an
+    object of every query to the list of its outputs, so that the data only
+    has to be passed to jq once
+
+    Parameters
+    ----------
+    compiled_queries : dict
+        Dict of queries to their tuple of keys or compiled jq program
+    queries : set
+        Queries to combine, the ones that don't need jq are ignored
+
+    Returns
+    -------
+    jq program or None
+        Combined jq program or None if none of the queries need jq
+    """
+
+    jq_queries = sorted(
+        query
+        for query in queries
+        if not isinstance(compiled_queries[query], tuple)
+    )
+
+    if not jq_queries:
+        return None
+
+    combined_query = ", ".join(
+        f"{json.dumps(query)}: [{query}]" for query in jq_queries
+    )
+
+    return jq.compile(f"{{{combined_query}}}")
+
+
+def run_combined_query(combined_query, data) -> dict:
+    """Run a jq program created by combine_jq_queries on the given data
+
+    Parameters
+    ----------
+    combined_query : jq program or None
+        Combined jq program
+    data : Any
+        Data to run the queries on
+
+    Returns
+    -------
+    dict
+        Dict of queries to the list of their outputs
+    """
+
+    if combined_query is None:
+        return {}
+
+    return combined_query.input_value(data).first()
+
+
+def run_query(compiled_queries: dict, query: str, data) -> list:
+    """Run a query compiled by compile_queries on the given data
+
+    Parameters
+    ----------
+    compiled_queries : dict
+        Dict of queries to their tuple of keys or compiled jq program
+    query : str
+        Query to run
+    data : Any
+        Data to run the query on
+
+    Returns
+    -------
+    list
+        List of the outputs of the query
+    """
+
+    compiled_query = compiled_queries[query]
+
+    # plain dict lookups are much cheaper than going through jq
+    if isinstance(compiled_query, tuple):
+        return [get_path(data, compiled_query)]
+
+    return compiled_query.input_value(data).all()
+
+
+def get_keys(json_data) -> list:
+    """Get the keys of a JSON object or the indexes of a JSON array, in the
+    same way as jq's keys
+
+    Parameters
+    ----------
+    json_data : dict or list
+        Data resulting from parsing a JSON file
+
+    Returns
+    -------
+    list
+        Sorted keys of the object or indexes of the array
+    """
+
+    if isinstance(json_data, list):
+        return list(range(len(json_data)))
+
+    return sorted(json_data)
+
+
 def get_evaluations(json_data: dict):
     """Get evaluation data from a given Medicover report
 
@@ -89,35 +330,84 @@ def get_evaluations(json_data: dict):
     return json_data[2]["data"]["evaluations"]
 
 
-def add_missing_keys(data):
-    """Add unique keys in all dicts contained in data as SQLAlchemy can't bulk
-    insert otherwise
+@functools.lru_cache(maxsize=8192)
+def format_value(value: str) -> str:
+    """Format a value from the report i.e. "LIKELY_PATHOGENIC" becomes
+    "Likely pathogenic". The values come from a small set of labels so the
+    results are cached
 
     Parameters
     ----------
-    data : list
-        List of dicts
+    value : str
+        Value to format
 
     Returns
     -------
-    list
-        List of dicts with all possible keys
+    str
+        Formatted value
     """
 
-    new_data = []
-    all_keys = set()
+    return " ".join(value.lower().capitalize().split("_"))
 
-    # gather all unique keys
-    for data_dict in data:
-        for key in data_dict:
-            all_keys.add(key)
 
-    for data_dict in data:
-        for key in all_keys:
-            # if the key is not present in the given dict, add it
-            if key not in data_dict:
-                data_dict[key] = None
+@functools.lru_cache(maxsize=256)
+def format_strength(strength: str) -> str:
+    """Format the strength of an ACGS code i.e. "VERY_STRONG" becomes "Very
+    Strong". Only a handful of strengths exist so the results are cached
 
-        new_data.append(data_dict)
+    Parameters
+    ----------
+    strength : str
+        Strength to format
 
-    return new_data
+    Returns
+    -------
+    str
+        Formatted strength
+    """
+
+    strength = " ".join(
+        [ele.capitalize() for ele in strength.lower().capitalize().split("_")]
+    )
+
+    if strength == "Standalone":
+        strength = "Stand-Alone"
+
+    return strength
+
+
+def keep_most_recent(data, subset: list, date_key: str) -> list:
+    """Remove the duplicated dicts, keeping the most recent one. The dicts
+    are read one at a time so that data can be a generator
+
+    Parameters
+    ----------
+    data : iterable
+        Iterable of dicts
+    subset : list
+        List of keys identifying duplicated dicts
+    date_key : str
+        Key of the ISO date used to find the most recent dict
+
+    Returns
+    -------
+    list
+        List of dicts without duplicates
+    """
+
+    most_recent = {}
+
+    for data_dict in data:
+        duplicate_key = tuple(data_dict.get(key) for key in subset)
+        date = data_dict.get(date_key)
+        # dicts without a date are considered the most recent ones
+        rank = (date is None, date or "")
+
+        # dicts read later win ties
+        if (
+            duplicate_key not in most_recent
+            or rank >= most_recent[duplicate_key][0]
+        ):
+            most_recent[duplicate_key] = (rank, data_dict)
+
+    return [data_dict for _, data_dict in most_recent.values()]
@@ -1,12 +1,14 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import datetime
-import json
+import functools
+import itertools
 from pathlib import Path
 import re
 import uuid
-import pandas as pd
 
-import jq
+import ahocorasick
+import polars as pl
 
 from medicover_aws import db, utils
 
@@ -40,6 +42,1024 @@ ACGS_CODES = [
     "BP7",
 ]
 
+R_CODE_REGEX = re.compile(r"R[0-9]+")
+
+SAMPLE_ID_REGEX = re.compile(
+    r"(?P<gm_number>GM[0-9]{2}_[0-9]+)|(?P<sp_number>SP[0-9]{5}R[0-9]{4})|(?P<gmnumber>GM[0-9]{2}[0-9]+)",
+    re.IGNORECASE,
+)
+
+# report structures identified by the sorted keys of the report (the indexes
+# for the standard structure which is a list) with the index of their first
+# evaluation
+REPORT_STRUCTURES = {
+    (0, 1, 2): ("standard", 1),
+    (
+        "assembly",
+        "citations",
+        "classificationSystem",
+        "cnvs",
+        "coverageSummary",
+        "customFields",
+        "evaluators",
+        "failedRegions",
+        "finalized",
+        "geneList",
+        "geneListDetails",
+        "genePanelName",
+        "geneThresholds",
+        "lastModifiedDate",
+        "lastModifiedDateUnix",
+        "lastModifiedEmail",
+        "lastModifiedUser",
+        "patientDisorders",
+        "patientPhenotypes",
+        "reportDate",
+        "reportDateUnix",
+        "resultsSummary",
+        "sampleId",
+        "sampleState",
+        "signedOffBy",
+        "signedOffDate",
+        "signedOffDateUnix",
+        "signedOffEmail",
+        "testResult",
+        "variants",
+        "versionedSources",
+    ): ("flat", 0),
+    (
+        "case_data",
+        "case_resolution_info",
+        "family_data",
+        "institution_info",
+        "report_info",
+        "signatures",
+        "technical_info",
+        "variants",
+    ): ("nested", 0),
+}
+
+# keys of the mapping that are queried on the evaluation instead of the variant
+EVALUATION_KEYS = ("date_last_evaluated", ".technical_info.genomic_build")
+
+# fields with the same value for every variant
+STATIC_FIELDS = {
+    "institution": "East Genomic Laboratory Hub, NHS Genomic Medicine Service",
+    "organisation": "Cambridge Genomics Laboratory",
+    "organisation_id": 288359,
+    "collection_method": "clinical testing",
+    "allele_origin": "germline",
+    "affected_status": "yes",
+    "interpreted": "yes",
+    "probeset_id": "Medicover TWE",
+}
+
+# fields identifying the same variant in a sample
+DUPLICATE_KEYS = [
+    "specimen_id",
+    "chromosome",
+    "start",
+    "reference_allele",
+    "alternate_allele",
+]
+
+# data shared by the reports processed in a worker process, see init_worker
+worker_data = {}
+
+
+def format_date(date: str, day_first: bool):
+    """Convert a date from the report to the ISO format
+
+    Parameters
+    ----------
+    date : str
+        Date from the report, either mm/dd/yyyy or dd/mm/yyyy
+    day_first : bool
+        Whether the day comes before the month in the date
+
+    Returns
+    -------
+    str
+        Date in the ISO format or None if the date can't be parsed
+    """
+
+    if not date:
+        return None
+
+    parts = date.split("/")
+
+    # usual dates are converted without going through strptime, the others
+    # are left to strptime to keep the same validation
+    if (
+        len(parts) == 3
+        and all(part.isdigit() for part in parts)
+        and len(parts[0]) <= 2
+        and len(parts[1]) <= 2
+        and len(parts[2]) == 4
+        and not parts[2].startswith("0")
+    ):
+        if day_first:
+            day, month, year = parts
+        else:
+            month, day, year = parts
+
+        try:
+            return datetime.date(int(year), int(month), int(day)).isoformat()
+        except ValueError:
+            return None
+
+    date_format = "%d/%m/%Y" if day_first else "%m/%d/%Y"
+
+    try:
+        return datetime.datetime.strptime(date, date_format).strftime(
+            "%Y-%m-%d"
+        )
+    except ValueError:
+        return None
+
+
+def handle_hgvsc(key, value, variant_data, evaluation, run_query) -> dict:
+    """Parse the hgvsc, which is not always directly available to parse from
+    the Medicover data but can be obtained by combining 2 fields
+
+    Parameters
+    ----------
+    key : str
+        Key of the mapping
+    value : list
+        Queries of the fields to combine
+    variant_data : dict
+        Variant data from the report
+    evaluation : dict
+        Evaluation data from the report
+    run_query : callable
+        Function running a query on the given data
+
+    Returns
+    -------
+    dict
+        Dict of the parsed fields
+    """
+
+    hgvsc = []
+
+    for jq_query in value:
+        jq_output = run_query(jq_query, variant_data)[0]
+
+        if jq_output:
+            hgvsc.append(jq_output)
+
+    if hgvsc:
+        return {key: ":".join(hgvsc)}
+
+    return {key: None}
+
+
+def handle_refalt(key, value, variant_data, evaluation, run_query) -> dict:
+    """Parse the refalt field which contains the reference and alternate so
+    it needs splitting out
+
+    Parameters
+    ----------
+    key : str
+        Key of the mapping
+    value : dict
+        Dict of the refalt query to the reference and alternate db columns
+    variant_data : dict
+        Variant data from the report
+    evaluation : dict
+        Evaluation data from the report
+    run_query : callable
+        Function running a query on the given data
+
+    Returns
+    -------
+    dict
+        Dict of the parsed fields
+    """
+
+    jq_query = list(value.keys())[0]
+    ref_key, alt_key = list(value.values())[0]
+
+    jq_output = run_query(jq_query, variant_data)[0]
+
+    if "/" in jq_output:
+        ref, alt = jq_output.split("/")
+    else:
+        ref = None
+        alt = None
+
+    return {ref_key: ref, alt_key: alt}
+
+
+def handle_nested_refalt(
+    key, value, variant_data, evaluation, run_query
+) -> dict:
+    """Parse the reference and alternate of the nested structure which are
+    usually stored in separate fields
+
+    Parameters
+    ----------
+    key : str
+        Key of the mapping
+    value : dict
+        Dict of the reference and alternate queries to the db columns
+    variant_data : dict
+        Variant data from the report
+    evaluation : dict
+        Evaluation data from the report
+    run_query : callable
+        Function running a query on the given data
+
+    Returns
+    -------
+    dict
+        Dict of the parsed fields
+    """
+
+    jq_query, jq_alt_query = list(value.keys())[:2]
+    ref_key, alt_key = list(value.values())[0]
+
+    jq_output = run_query(jq_query, variant_data)[0]
+
+    if "/" in jq_output:
+        ref, alt = jq_output.split("/")
+    else:
+        ref = jq_output
+        alt = run_query(jq_alt_query, variant_data)[0]
+
+    return {ref_key: ref, alt_key: alt}
+
+
+def handle_date_last_evaluated(
+    key, value, variant_data, evaluation, run_query
+) -> dict:
+    """Parse the date of the evaluation which is in the US format
+
+    Parameters
+    ----------
+    key : str
+        Key of the mapping
+    value : str
+        Query of the date
+    variant_data : dict
+        Variant data from the report
+    evaluation : dict
+        Evaluation data from the report
+    run_query : callable
+        Function running a query on the given data
+
+    Returns
+    -------
+    dict
+        Dict of the parsed fields
+    """
+
+    jq_output = run_query(value, evaluation)[0]
+    return {key: format_date(jq_output, day_first=False)}
+
+
+def handle_nested_date_last_evaluated(
+    key, value, variant_data, evaluation, run_query
+) -> dict:
+    """Parse the date of the evaluation of the nested structure which is not
+    in the US format
+
+    Parameters
+    ----------
+    key : str
+        Key of the mapping
+    value : str
+        Query of the date
+    variant_data : dict
+        Variant data from the report
+    evaluation : dict
+        Evaluation data from the report
+    run_query : callable
+        Function running a query on the given data
+
+    Returns
+    -------
+    dict
+        Dict of the parsed fields
+    """
+
+    jq_output = run_query(value, evaluation)[0]
+    return {key: format_date(jq_output, day_first=True)}
+
+
+def handle_code(key, value, variant_data, evaluation, run_query) -> dict:
+    """Parse the ACGS codes and their strength
+
+    Parameters
+    ----------
+    key : str
+        Key of the mapping
+    value : str
+        Query of the codes and strengths
+    variant_data : dict
+        Variant data from the report
+    evaluation : dict
+        Evaluation data from the report
+    run_query : callable
+        Function running a query on the given data
+
+    Returns
+    -------
+    dict
+        Dict of the lowercase codes to their strength
+    """
+
+    parsed_data = {}
+    jq_output = run_query(value, variant_data)
+
+    for criteria in jq_output:
+        # criteria alternate between code and strength, zipping the same
+        # iterator with itself pairs them without slicing the list
+        criteria_iter = iter(criteria)
+
+        for code, strength in zip(criteria_iter, criteria_iter):
+            reformatted_code = code.split("_")[0]
+
+            if reformatted_code.upper() in ACGS_CODES:
+                parsed_data[reformatted_code.lower()] = utils.format_strength(
+                    strength
+                )
+
+    return parsed_data
+
+
+def handle_flat_code(key, value, variant_data, evaluation, run_query) -> dict:
+    """Parse the ACGS codes of the flat structure, where the criteria have no
+    separate strength so the strength is taken from the code suffix
+
+    Parameters
+    ----------
+    key : str
+        Key of the mapping
+    value : str
+        Query of the codes
+    variant_data : dict
+        Variant data from the report
+    evaluation : dict
+        Evaluation data from the report
+    run_query : callable
+        Function running a query on the given data
+
+    Returns
+    -------
+    dict
+        Dict of the lowercase codes to their strength
+    """
+
+    parsed_data = {}
+    jq_output = run_query(value, variant_data)
+
+    for code in jq_output[0]:
+        reformatted_code = code.split("_")[0]
+        try:
+            strength = code.split("_")[1].title()
+        except IndexError:
+            strength = "Stand-Alone"
+        if reformatted_code.upper() in ACGS_CODES:
+            parsed_data[reformatted_code.lower()] = strength
+
+    return parsed_data
+
+
+def handle_reported(key, value, variant_data, evaluation, run_query) -> dict:
+    """Parse whether the variant was reported
+
+    Parameters
+    ----------
+    key : str
+        Key of the mapping
+    value : str
+        Query of the report section
+    variant_data : dict
+        Variant data from the report
+    evaluation : dict
+        Evaluation data from the report
+    run_query : callable
+        Function running a query on the given data
+
+    Returns
+    -------
+    dict
+        Dict of the parsed fields
+    """
+
+    jq_output = run_query(value, variant_data)
+
+    if len(jq_output) != 1:
+        return {}
+
+    output = jq_output[0]
+
+    if output == "REPORTING" or output == "Reporting":
+        output = "yes"
+    else:
+        output = "no"
+
+    return {"reported": output}
+
+
+def handle_nested_reported(
+    key, value, variant_data, evaluation, run_query
+) -> dict:
+    """Infer whether the variant was reported for the nested structure, which
+    has no reported field, from whether the finding is primary or secondary
+
+    Parameters
+    ----------
+    key : str
+        Key of the mapping
+    value : str
+        Placeholder value of the mapping
+    variant_data : dict
+        Variant data from the report
+    evaluation : dict
+        Evaluation data from the report
+    run_query : callable
+        Function running a query on the given data
+
+    Returns
+    -------
+    dict
+        Dict of the parsed fields
+    """
+
+    if variant_data.get("finding_type", "") == "primary_findings":
+        return {"reported": "yes"}
+
+    return {"reported": "no"}
+
+
+def handle_consequence(
+    key, value, variant_data, evaluation, run_query
+) -> dict:
+    """Parse the consequence of the variant
+
+    Parameters
+    ----------
+    key : str
+        Query of the consequence
+    value : str
+        Db column of the consequence
+    variant_data : dict
+        Variant data from the report
+    evaluation : dict
+        Evaluation data from the report
+    run_query : callable
+        Function running a query on the given data
+
+    Returns
+    -------
+    dict
+        Dict of the parsed fields
+    """
+
+    jq_output = run_query(key, variant_data)
+
+    if len(jq_output) == 1:
+        output = jq_output[0]
+    else:
+        output = "&".join(jq_output)
+
+    return {value: output}
+
+
+def handle_chr(key, value, variant_data, evaluation, run_query) -> dict:
+    """Parse the chromosome without its "chr" prefix
+
+    Parameters
+    ----------
+    key : str
+        Query of the chromosome
+    value : str
+        Db column of the chromosome
+    variant_data : dict
+        Variant data from the report
+    evaluation : dict
+        Evaluation data from the report
+    run_query : callable
+        Function running a query on the given data
+
+    Returns
+    -------
+    dict
+        Dict of the parsed fields
+    """
+
+    jq_output = run_query(key, variant_data)[0]
+    return {"chromosome": jq_output.lower().lstrip("chr")}
+
+
+def handle_evidence_list(
+    key, value, variant_data, evaluation, run_query
+) -> dict:
+    """Parse the evidence list into the comment on classification
+
+    Parameters
+    ----------
+    key : str
+        Query of the evidence list
+    value : str
+        Db column of the comment on classification
+    variant_data : dict
+        Variant data from the report
+    evaluation : dict
+        Evaluation data from the report
+    run_query : callable
+        Function running a query on the given data
+
+    Returns
+    -------
+    dict
+        Dict of the parsed fields
+    """
+
+    jq_output = run_query(key, variant_data)
+
+    if not jq_output:
+        return {"comment_on_classification": None}
+
+    comments = []
+    for ele in jq_output:
+        if ele is not None:
+            comments.append(" ".join(ele.split()))
+
+    formatted_output = " | ".join(comments)
+
+    return {"comment_on_classification": formatted_output.strip()}
+
+
+def handle_interpretation(
+    key, value, variant_data, evaluation, run_query
+) -> dict:
+    """Parse the interpretation into the comment on classification
+
+    Parameters
+    ----------
+    key : str
+        Query of the interpretation
+    value : str
+        Db column of the comment on classification
+    variant_data : dict
+        Variant data from the report
+    evaluation : dict
+        Evaluation data from the report
+    run_query : callable
+        Function running a query on the given data
+
+    Returns
+    -------
+    dict
+        Dict of the parsed fields
+    """
+
+    jq_output = run_query(key, variant_data)[0]
+
+    if not jq_output:
+        return {"comment_on_classification": None}
+
+    formatted_output = " ".join(jq_output.split())
+    return {"comment_on_classification": formatted_output.strip()}
+
+
+def handle_generic(key, value, variant_data, evaluation, run_query) -> dict:
+    """Parse a field that doesn't need specific handling
+
+    Parameters
+    ----------
+    key : str
+        Query of the field
+    value : str
+        Db column of the field
+    variant_data : dict
+        Variant data from the report
+    evaluation : dict
+        Evaluation data from the report
+    run_query : callable
+        Function running a query on the given data
+
+    Returns
+    -------
+    dict
+        Dict of the parsed fields
+    """
+
+    if key in EVALUATION_KEYS:
+        input_data = evaluation
+    else:
+        input_data = variant_data
+
+    jq_output = run_query(key, input_data)
+
+    formatted_output = " | ".join(
+        [str(ele).replace(", which is", "") for ele in jq_output]
+    )
+
+    if formatted_output == "GRCh_37_g1k,Chromosome,Homo sapiens":
+        formatted_output = "GRCh37.p13"
+    elif (
+        formatted_output == "HG38"
+        or formatted_output == "GRCh_38,Chromosome,Homo sapiens"
+        or formatted_output == "GRCh38"
+    ):
+        formatted_output = "GRCh38.p14"
+    # rescue gene symbol when geneName field doesn't exist
+    elif formatted_output == "None" and value == "gene_symbol":
+        jq_output = run_query(".acmgScoring.interpretedGene", variant_data)
+
+        formatted_output = " ".join(jq_output)
+
+    # need to keep the gene symbol uppercase
+    elif value == "gene_symbol":
+        formatted_output = " ".join(formatted_output.split("_"))
+    else:
+        formatted_output = utils.format_value(formatted_output)
+
+    if formatted_output == "None":
+        formatted_output = None
+
+    return {value: formatted_output}
+
+
+# handlers of the mapping keys that need specific parsing
+FIELD_HANDLERS = {
+    "hgvsc": handle_hgvsc,
+    "refalt": handle_refalt,
+    "date_last_evaluated": handle_date_last_evaluated,
+    "code": handle_code,
+    "reported": handle_reported,
+    ".chr": handle_chr,
+    ".interpretation": handle_interpretation,
+}
+
+# handlers specific to a report structure, they take precedence over
+# FIELD_HANDLERS. A None handler means the key is not parsed
+STRUCTURE_FIELD_HANDLERS = {
+    "flat": {"code": handle_flat_code},
+    # no codes section in nested structure - user to read from
+    # interpretation comments
+    "nested": {
+        "refalt": handle_nested_refalt,
+        "date_last_evaluated": handle_nested_date_last_evaluated,
+        "code": None,
+        "reported": handle_nested_reported,
+    },
+}
+
+
+def get_field_handler(key: str, structure: str):
+    """Get the function parsing the given key of the mapping
+
+    Parameters
+    ----------
+    key : str
+        Key of the mapping
+    structure : str
+        Structure of the report
+
+    Returns
+    -------
+    callable
+        Function parsing the key or None if the key is not parsed
+    """
+
+    structure_handlers = STRUCTURE_FIELD_HANDLERS.get(structure, {})
+
+    if key in structure_handlers:
+        return structure_handlers[key]
+
+    if key in FIELD_HANDLERS:
+        return FIELD_HANDLERS[key]
+
+    if "equenceOntology" in key or key == ".effect":
+        return handle_consequence
+
+    if ".evidenceList[]" in key:
+        return handle_evidence_list
+
+    return handle_generic
+
+
+def run_variant_query(
+    compiled_queries: dict, variant_data: dict, jq_outputs: dict, query, data
+) -> list:
+    """Run a query, reusing the output of the combined jq program of the
+    variant if the query is run on the variant data
+
+    Parameters
+    ----------
+    compiled_queries : dict
+        Dict of queries to their tuple of keys or compiled jq program
+    variant_data : dict
+        Variant data the combined jq program was run on
+    jq_outputs : dict
+        Outputs of utils.run_combined_query for the variant data
+    query : str
+        Query to run
+    data : Any
+        Data to run the query on
+
+    Returns
+    -------
+    list
+        List of the outputs of the query
+    """
+
+    # the combined outputs are only valid for the data they were computed on
+    if data is variant_data and query in jq_outputs:
+        return jq_outputs[query]
+
+    return utils.run_query(compiled_queries, query, data)
+
+
+def build_field_parsers(structure_mapping: dict, structure: str) -> list:
+    """Bind the handlers of the keys of a structure mapping to their key and
+    value, so that the mapping doesn't have to be dispatched again for every
+    variant
+
+    Parameters
+    ----------
+    structure_mapping : dict
+        Dict containing the mapping between the report fields and the db
+        columns for a report structure
+    structure : str
+        Structure of the report
+
+    Returns
+    -------
+    list
+        List of functions taking the variant data, the evaluation data and
+        the function running queries, and returning the parsed fields
+    """
+
+    field_parsers = []
+
+    for key, value in structure_mapping.items():
+        handler = get_field_handler(key, structure)
+
+        if handler is not None:
+            field_parsers.append(functools.partial(handler, key, value))
+
+    return field_parsers
+
+
+def process_report(
+    report: str,
+    field_parsers: dict,
+    compiled_queries: dict,
+    combined_queries: dict,
+    sample_as_key: dict,
+) -> tuple:
+    """Parse the variants of a Medicover report
+
+    Parameters
+    ----------
+    report : str
+        Path to the Medicover JSON report file
+    field_parsers : dict
+        Dict of report structures to the field parsers built by
+        build_field_parsers
+    compiled_queries : dict
+        Dict of the compiled queries of the field mappings
+    combined_queries : dict
+        Dict of report structures to the jq program combining the variant
+        queries of their field mappings
+    sample_as_key : dict
+        Dict of sample ids to their panel data
+
+    Returns
+    -------
+    tuple
+        Tuple containing the list of dicts of parsed variants, or None if the
+        report structure is not recognised, and the number of evaluations
+        without variants
+    """
+
+    data_to_import = []
+    no_variants = 0
+
+    print(f"Processing report: {report}")
+    report_data = utils.parse_json(report)
+
+    # the structure of the report is identified by its keys
+    structure_data = REPORT_STRUCTURES.get(
+        tuple(utils.get_keys(report_data))
+    )
+
+    if structure_data is None:
+        print(f"Skipping {report} as its structure does not match expected formats.")
+        return None, 0
+
+    structure, startPoint = structure_data
+
+    if structure == "standard":
+        evaluations = utils.get_evaluations(report_data)
+    else:
+        evaluations = [report_data]
+
+    # fields with the same value for all the variants of the report
+    report_fields = {}
+
+    # the sample id is in the report file name so it only needs finding
+    # once per report
+    match = SAMPLE_ID_REGEX.search(report)
+
+    if match:
+        gm_number = match.group("gm_number")
+        gmnumber = match.group("gmnumber")
+        sp_number = match.group("sp_number")
+        if gm_number:
+            specimen_id = gm_number.replace("_", ".").upper()
+        elif gmnumber:
+            specimen_id = (gmnumber[:4] + "." + gmnumber[4:]).upper()
+        elif sp_number:
+            specimen_id = sp_number.upper()
+        else:
+            specimen_id = None
+
+        sample_data = sample_as_key.get(specimen_id, None)
+        report_fields["specimen_id"] = specimen_id
+
+        if sample_data:
+            r_codes = sample_data["r_code"]
+
+            if sample_data["panel_name"]:
+                report_fields["preferred_condition_name"] = ", ".join(
+                    sample_data["panel_name"]
+                )
+
+            if r_codes:
+                report_fields["r_code"] = ", ".join(r_codes)
+
+            report_fields["panel"] = sample_data["panel"]
+
+        else:
+            report_fields["panel"] = "Sample not in Medicover data"
+
+    report_fields.update(STATIC_FIELDS)
+
+    for j, evaluation in enumerate(evaluations, startPoint):
+
+        if not evaluation:
+            continue
+
+        # flatten nested structure to enable loop below
+        if structure == "nested":
+            variants = []
+            for finding_type in evaluation["variants"]:
+                for variant in evaluation["variants"][finding_type]["snp"]:
+                    variant["finding_type"] = finding_type
+                    variants.append(variant)
+        else:
+            variants = evaluation["variants"]
+        
+        if len(variants) == 0:
+            print(f"No variants present.")
+            no_variants += 1
+                    
+        for variant_data in variants:
+            parsed_variant_data = {}
+            # run the queries that need jq on the variant in one go
+            jq_outputs = utils.run_combined_query(
+                combined_queries[structure], variant_data
+            )
+
+            run_query = functools.partial(
+                run_variant_query, compiled_queries, variant_data, jq_outputs
+            )
+
+            # look for data in the report json
+            for parse_field in field_parsers[structure]:
+                parsed_variant_data.update(
+                    parse_field(variant_data, evaluation, run_query)
+                )
+
+            parsed_variant_data.update(report_fields)
+
+            data_to_import.append(parsed_variant_data)
+
+    return data_to_import, no_variants
+
+
+def init_worker(mapping_json_keys: dict, sample_as_key: dict):
+    """Store the data needed to process reports in a worker process. The
+    queries are compiled in every worker as jq programs can't be pickled
+
+    Parameters
+    ----------
+    mapping_json_keys : dict
+        Dict with the field mappings for every report structure
+    sample_as_key : dict
+        Dict of sample ids to their panel data
+    """
+
+    worker_data["field_parsers"] = {
+        structure: build_field_parsers(structure_mapping, structure)
+        for structure, structure_mapping in mapping_json_keys.items()
+    }
+    worker_data["compiled_queries"] = utils.compile_queries(
+        mapping_json_keys, ".acmgScoring.interpretedGene"
+    )
+    worker_data["combined_queries"] = {
+        structure: utils.combine_jq_queries(
+            worker_data["compiled_queries"],
+            utils.get_queries(structure_mapping, *EVALUATION_KEYS),
+        )
+        for structure, structure_mapping in mapping_json_keys.items()
+    }
+    worker_data["sample_as_key"] = sample_as_key
+
+
+def process_report_in_worker(report: str) -> tuple:
+    """Parse the variants of a Medicover report using the data set up by
+    init_worker
+
+    Parameters
+    ----------
+    report : str
+        Path to the Medicover JSON report file
+
+    Returns
+    -------
+    tuple
+        Output of process_report
+    """
+
+    return process_report(
+        report,
+        worker_data["field_parsers"],
+        worker_data["compiled_queries"],
+        worker_data["combined_queries"],
+        worker_data["sample_as_key"],
+    )
+
+
+def iter_rows(
+    reports: list,
+    mapping_json_keys: dict,
+    sample_as_key: dict,
+    jobs: int = None,
+):
+    """Process the reports and yield the parsed variants one at a time
+
+    Parameters
+    ----------
+    reports : list
+        List of paths to Medicover JSON report files
+    mapping_json_keys : dict
+        Dict containing the mapping between the report fields and the db
+        columns
+    sample_as_key : dict
+        Dict of sample ids to their panels, r codes and panel names
+    jobs : int, optional
+        Number of processes parsing the reports, by default the number of
+        CPUs
+
+    Yields
+    ------
+    dict
+        Dict of the parsed variant data
+    """
+
+    skipped_reports = 0
+    no_variants = 0
+
+    nb_reports = len(reports)
+    # ids only need to be unique so count up from the current uuid1
+    # timestamp instead of generating a uuid for every variant
+    uid_counter = itertools.count(uuid.uuid1().time)
+
+    # reports are independent from each other so they are processed in
+    # parallel, the ids are generated here to keep them unique across workers
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=init_worker,
+        initargs=(mapping_json_keys, sample_as_key),
+    ) as executor:
+        for i, (report_data_to_import, report_no_variants) in enumerate(
+            executor.map(process_report_in_worker, reports, chunksize=8), 1
+        ):
+            if report_data_to_import is None:
+                skipped_reports += 1
+            else:
+                no_variants += report_no_variants
+
+                for parsed_variant_data in report_data_to_import:
+                    unique_id = f"uid_{next(uid_counter)}"
+                    parsed_variant_data["local_id"] = unique_id
+                    parsed_variant_data["linking_id"] = unique_id
+                    yield parsed_variant_data
+
+            print(f"{i}/{nb_reports} reports have been processed")
+
+    print(f"Skipped {skipped_reports} empty reports")
+    print(f"{no_variants} reports had no variants included")
+
 
 def main(
     reports: list,
@@ -51,6 +1071,7 @@ def main(
     write: bool,
     db_import: bool,
     dump: str = None,
+    jobs: int = None,
 ):
     """Process Medicover reports and import data into the database.
 
@@ -69,11 +1090,15 @@ def main(
     mapping_rescued_panels : str
         Path to TSV file with mapping for rescued panels
     write : bool
-        Whether to write results to a JSON file
+        Whether to write results to a NDJSON file
     db_import : bool
         Whether to import results into the database
     dump : str, optional
-        Path to previously processed data dump to bypass processing
+        Path to previously processed data dump to bypass processing, either
+        the NDJSON file written by this script or a JSON list
+    jobs : int, optional
+        Number of processes parsing the reports, by default the number of
+        CPUs
     """
 
     db_creds = utils.parse_json(config_file)
@@ -81,511 +1106,151 @@ def main(
     inca_table = meta.tables["testdirectory.inca"]
 
     if dump:
-        dump_data = utils.parse_json(dump)
+        # dumps are written as NDJSON but older JSON dumps are still
+        # supported
+        if Path(dump).suffix == ".ndjson":
+            dump_data = pl.read_ndjson(dump, infer_schema_length=None)
+        else:
+            dump_data = pl.DataFrame(
+                utils.parse_json(dump), infer_schema_length=None
+            )
+
         db.insert_in_db(session, inca_table, dump_data)
         exit()
 
     mapping_json_keys = utils.parse_json(mapping_json_keys_file)
     mapping_panels = utils.parse_xlsx(xlsx)
-    panelapp_dump = utils.parse_tsv(
-        panelapp_file, "id", "name", "relevant_disorders"
-    )
+    panelapp_dump = utils.parse_panelapp_dump(panelapp_file)
     mapping_rescued_panels = utils.parse_tsv(
         mapping_rescued_panels, "raw_panel", "new_panel", "r_code"
     )
 
-    medicover_data = mapping_panels[["CUH sample number", "Panels"]].to_dicts()
+    medicover_data = mapping_panels.to_dicts()
 
     sample_as_key = {
-        row["CUH sample number"].upper(): {"Panels": row["Panels"]}
+        row["CUH sample number"].upper(): {
+            "Panels": row["Panels"],
+            # panels as written in the db, built once per sample rather than
+            # once per report
+            "panel": ", ".join([panel.strip("_") for panel in row["Panels"]]),
+            "r_code": set(),
+            "panel_name": set(),
+        }
         for row in medicover_data
     }
 
-    # insert a none column called r_code
-    # loop through the panels
+    # gather the panelapp data once instead of once per sample
+    panelapp_panels = []
+
     for panel_data in panelapp_dump:
-        relevant_disorders = eval(panel_data["relevant_disorders"])
-        panel_name = panel_data["name"]
+        relevant_disorders = panel_data["relevant_disorders"]
         r_code = []
-        r_code_info = []
 
         # find the r code
         for disorder in relevant_disorders:
-            if re.search(r"R[0-9]+", disorder):
+            if R_CODE_REGEX.search(disorder):
                 r_code.append(disorder)
 
-        if r_code:
-            r_code_info = ", ".join(r_code)
+        panelapp_panels.append(
+            (panel_data["name"], relevant_disorders, ", ".join(r_code))
+        )
+
+    # build a single automaton over the panelapp names and disorders so that
+    # the panels of a sample are scanned once for all of them
+    panel_words = {}
+    # an empty panel name or disorder is a substring of every panel so these
+    # panels match every sample, the automaton doesn't accept empty words so
+    # they are kept aside
+    always_matched_panels = set()
+
+    for i, (panel_name, relevant_disorders, r_code_info) in enumerate(
+        panelapp_panels
+    ):
+        # panels without r-code are never assigned to a sample
+        if not r_code_info:
+            continue
 
-        for sample, panels in sample_as_key.items():
-            rescued = False
+        for word, is_panel_name in itertools.chain(
+            [(panel_name, True)],
+            ((disorder, False) for disorder in relevant_disorders),
+        ):
+            if word:
+                panel_words.setdefault(word, []).append((i, is_panel_name))
+            else:
+                always_matched_panels.add(i)
 
-            # use the mapping to rescue some panels that aren't automatically
-            # attributed a r-code using the panelapp dump
-            for data in mapping_rescued_panels:
-                raw_panel_data_to_match_rescue_mapping = ", ".join(
-                    [ele.lstrip("_") for ele in panels["Panels"]]
-                )
+    automaton = ahocorasick.Automaton()
 
-                if raw_panel_data_to_match_rescue_mapping == data["raw_panel"]:
-                    if data["r_code"]:
-                        sample_as_key[sample].setdefault("r_code", set()).add(
-                            f"R{data['r_code']}"
-                        )
+    for word, hits in panel_words.items():
+        automaton.add_word(word, (len(word), hits))
 
-                    sample_as_key[sample].setdefault("panel_name", set()).add(
-                        data["new_panel"]
-                    )
+    if panel_words:
+        automaton.make_automaton()
 
-                    rescued = True
-                    break
+    # index the rescue mapping on the raw panels, the first entry wins if a
+    # raw panel appears more than once
+    rescue_lookup = {}
 
-            if rescued:
-                continue
+    for data in mapping_rescued_panels:
+        rescue_lookup.setdefault(data["raw_panel"], data)
 
-            for panel in panels["Panels"]:
-                matched = False
-                if panel_name in panel:
-                    matched = True
-                    break
+    for entry in sample_as_key.values():
+        raw_panel_data_to_match_rescue_mapping = ", ".join(
+            [ele.lstrip("_") for ele in entry["Panels"]]
+        )
 
-                for disorder in relevant_disorders:
-                    if disorder in panel:
-                        matched = True
-                        break
+        # use the mapping to rescue some panels that aren't automatically
+        # attributed a r-code using the panelapp dump
+        data = rescue_lookup.get(raw_panel_data_to_match_rescue_mapping)
 
-            if matched and r_code_info:
-                sample_as_key[sample].setdefault("r_code", set()).add(
-                    r_code_info
-                )
-                sample_as_key[sample].setdefault("panel_name", set()).add(
-                    panel_name
-                )
-
-    data_to_import = []
-    skipped_reports = 0
-    no_variants = 0
+        if data:
+            if data["r_code"]:
+                entry["r_code"].add(f"R{data['r_code']}")
 
-    nb_reports = len(reports)
+            entry["panel_name"].add(data["new_panel"])
 
-    for i, report in enumerate(reports, 1):
-        print(f"Processing report: {report}")
-        report_data = utils.parse_json(report)
-
-        # Structure of json will be one of:
-        # Standard - [0,1,2]
-        # Flat - [assembly,citations,classificationSystem,cnvs,coverageSummary,customFields,evaluators,failedRegions,finalized,geneList,geneListDetails,genePanelName,geneThresholds,lastModifiedDate,lastModifiedDateUnix,lastModifiedEmail,lastModifiedUser,patientDisorders,patientPhenotypes,reportDate,reportDateUnix,resultsSummary,sampleId,sampleState,signedOffBy,signedOffDate,signedOffDateUnix,signedOffEmail,testResult,variants,versionedSources]
-        # Nested - [case_data,case_resolution_info,family_data,institution_info,report_info,signatures,technical_info,variants]
-
-        if jq.compile("keys").input_value(report_data).all() == [[0, 1, 2]]:
-            evaluations = utils.get_evaluations(report_data)
-            startPoint=1
-            structure = 'standard'
-        elif jq.compile("keys").input_value(report_data).all() == [['assembly','citations','classificationSystem','cnvs','coverageSummary','customFields','evaluators','failedRegions','finalized','geneList','geneListDetails','genePanelName','geneThresholds','lastModifiedDate','lastModifiedDateUnix','lastModifiedEmail','lastModifiedUser','patientDisorders','patientPhenotypes','reportDate','reportDateUnix','resultsSummary','sampleId','sampleState','signedOffBy','signedOffDate','signedOffDateUnix','signedOffEmail','testResult','variants','versionedSources']]:
-            evaluations = [report_data]
-            startPoint=0
-            structure = 'flat'
-        elif jq.compile("keys").input_value(report_data).all() == [['case_data','case_resolution_info','family_data','institution_info','report_info','signatures','technical_info','variants']]:
-            evaluations = [report_data]
-            startPoint=0
-            structure = 'nested'
-        else:
-            print(f"Skipping {report} as its structure does not match expected formats.")
-            skipped_reports += 1
             continue
 
-
-        for j, evaluation in enumerate(evaluations, startPoint):
-
-            if not evaluation:
-                continue
-
-            # flatten nested structure to enable loop below
-            if structure == "nested":
-                variants = []
-                for finding_type in evaluation["variants"]:
-                    for variant in evaluation["variants"][finding_type]["snp"]:
-                        variant["finding_type"] = finding_type
-                        variants.append(variant)
-            else:
-                variants = evaluation["variants"]
-            
-            if len(variants) == 0:
-                print(f"No variants present.")
-                no_variants += 1
-                        
-            for variant_data in variants:
-                parsed_variant_data = {}
-
-                # look for data in the report json
-                for key, value in mapping_json_keys[structure].items():
-                    # hgvsc is not always directly available to parse
-                    # from the medicover data but can be obtained by
-                    # combining 2 fields
-                    if key == "hgvsc":
-                        hgvsc = []
-
-                        for jq_query in value:
-                            jq_output = (
-                                jq.compile(jq_query)
-                                .input_value(variant_data)
-                                .first()
-                            )
-
-                            if jq_output:
-                                hgvsc.append(jq_output)
-
-                        if hgvsc:
-                            parsed_variant_data[key] = ":".join(hgvsc)
-                        else:
-                            parsed_variant_data[key] = None
-
-                    # refalt contains the reference and alternate so it needs
-                    # splitting out
-                    elif key == "refalt":
-                        jq_query = list(value.keys())[0]
-                        if structure == 'nested':
-                            jq_alt_query = list(value.keys())[1]
-                        db_key = list(value.values())[0]
-                        ref_key, alt_key = db_key
-
-                        jq_output = (
-                            jq.compile(jq_query)
-                            .input_value(variant_data)
-                            .first()
-                        )
-
-                        if "/" in jq_output:
-                            ref, alt = jq_output.split("/")
-                        elif structure == 'nested':
-                            ref = jq_output
-                            alt = jq.compile(jq_alt_query).input_value(variant_data).first()
-                        else:
-                            ref = None
-                            alt = None
-
-                        parsed_variant_data[ref_key] = ref
-                        parsed_variant_data[alt_key] = alt
-
-                    elif key == "date_last_evaluated":
-                        jq_query = value
-                        jq_output = (
-                            jq.compile(jq_query)
-                            .input_value(evaluation)
-                            .first()
-                        )
-
-                        if jq_output:
-                            try:
-                                if structure == 'nested':
-                                    # date is not in US format
-                                    parsed_variant_data[key] = (
-                                        datetime.datetime.strptime(
-                                            jq_output, "%d/%m/%Y"
-                                        ).strftime("%Y-%m-%d")
-                                    )
-                                else:
-                                    parsed_variant_data[key] = (
-                                        datetime.datetime.strptime(
-                                            jq_output, "%m/%d/%Y"
-                                        ).strftime("%Y-%m-%d")
-                                    )
-                            except ValueError:
-                                parsed_variant_data[key] = None
-                        else:
-                            parsed_variant_data[key] = None
-
-                    # handle the ACGS codes
-                    # no codes section in nested structure - user to read from interpretation comments
-                    elif key == "code" and structure == 'nested':
-                        continue
-                    elif key == "code":
-                        jq_query = value
-                        jq_output = (
-                            jq.compile(jq_query)
-                            .input_value(variant_data)
-                            .all()
-                        )
-                        # criteria has no strength in flat structure so just get codes
-                        if structure == 'flat':
-                            for code in jq_output[0]:
-                                reformatted_code = code.split("_")[0]
-                                try:
-                                    strength = code.split("_")[1].title()
-                                except IndexError:
-                                    strength = "Stand-Alone"
-                                if reformatted_code.upper() in ACGS_CODES:
-                                    parsed_variant_data[
-                                    reformatted_code.lower()
-                                    ] = strength
-                        else:
-                            for criteria in jq_output:
-                                for code, strength in list(
-                                    zip(criteria, criteria[1:])
-                                )[::2]:
-                                    strength = " ".join(
-                                        [
-                                            ele.capitalize()
-                                            for ele in strength.lower()
-                                            .capitalize()
-                                            .split("_")
-                                        ]
-                                    )
-
-                                    if strength == "Standalone":
-                                        strength = "Stand-Alone"
-
-                                    reformatted_code = code.split("_")[0]
-
-                                    if reformatted_code.upper() in ACGS_CODES:
-                                        parsed_variant_data[
-                                            reformatted_code.lower()
-                                        ] = strength
-
-                    elif key == "reported":
-                        # The nested ones do not have a reported field but status can be inferred from whether the finding is primary or secondary
-                        if structure == 'nested':
-                            if variant_data.get("finding_type","") == "primary_findings":
-                                parsed_variant_data["reported"] = "yes"
-                            else:
-                                parsed_variant_data["reported"] = "no"
-                        else:
-                            jq_query = value
-                            jq_output = (
-                                jq.compile(jq_query)
-                                .input_value(variant_data)
-                                .all()
-                            )
-
-                            if len(jq_output) == 1:
-                                output = jq_output[0]
-
-                                if output == "REPORTING" or output == "Reporting":
-                                    output = "yes"
-                                else:
-                                    output = "no"
-
-                                parsed_variant_data["reported"] = output
-                    elif "equenceOntology" in key or key == ".effect":
-                        jq_query = key
-                        jq_output = (
-                            jq.compile(jq_query)
-                            .input_value(variant_data)
-                            .all()
-                        )
-
-                        if len(jq_output) == 1:
-                            output = jq_output[0]
-                        else:
-                            output = "&".join(jq_output)
-
-                        parsed_variant_data[value] = output
-                    elif key == ".chr":
-                        jq_query = key
-                        jq_output = (
-                            jq.compile(jq_query)
-                            .input_value(variant_data)
-                            .first()
-                        )
-
-                        output = jq_output.lower().lstrip("chr")
-
-                        parsed_variant_data["chromosome"] = output
-                    elif ".evidenceList[]" in key:
-                        jq_query = key
-                        jq_output = (
-                            jq.compile(jq_query)
-                            .input_value(variant_data)
-                            .all()
-                        )
-
-                        if jq_output:
-                            comments = []
-                            for ele in jq_output:
-                                if ele is not None:
-                                    comments.append(" ".join(ele.split()))
-
-                            formatted_output = " | ".join(comments)
-
-                            parsed_variant_data["comment_on_classification"] = formatted_output.strip()
-                        else:
-                            parsed_variant_data["comment_on_classification"] = None
-                    elif key == ".interpretation":
-                        jq_query = key
-                        jq_output = (
-                            jq.compile(jq_query)
-                            .input_value(variant_data)
-                            .first()
-                        )
-
-                        if jq_output:
-                            formatted_output = " ".join(
-                                jq_output.split()
-                            )
-                            parsed_variant_data["comment_on_classification"] = formatted_output.strip()
-                        else:
-                            parsed_variant_data["comment_on_classification"] = None
-                        
-                    else:
-                        jq_query = key
-                        if key == ".technical_info.genomic_build":
-                            input_data = evaluation
-                        else:
-                            input_data = variant_data
-                        jq_output = (
-                            jq.compile(jq_query)
-                            .input_value(input_data)
-                            .all()
-                        )
-
-                        formatted_output = " | ".join(
-                            [
-                                str(ele).replace(", which is", "")
-                                for ele in jq_output
-                            ]
-                        )
-
-                        if (
-                            formatted_output
-                            == "GRCh_37_g1k,Chromosome,Homo sapiens"
-                        ):
-                            formatted_output = "GRCh37.p13"
-                        elif (
-                            formatted_output == "HG38"
-                            or
-                            formatted_output == "GRCh_38,Chromosome,Homo sapiens"
-                            or
-                            formatted_output == "GRCh38"
-                        ):
-                            formatted_output = "GRCh38.p14"
-                        # rescue gene symbol when geneName field doesn't exist
-                        elif (
-                            formatted_output == "None"
-                            and value == "gene_symbol"
-                        ):
-                            jq_output = (
-                                jq.compile(".acmgScoring.interpretedGene")
-                                .input_value(variant_data)
-                                .all()
-                            )
-
-                            formatted_output = " ".join(jq_output)
-                        
-                        # need to keep the gene symbol uppercase
-                        elif value == "gene_symbol":
-                            formatted_output = " ".join(
-                                formatted_output.split("_")
-                            )
-                        else:
-                            formatted_output = " ".join(
-                                formatted_output.lower()
-                                .capitalize()
-                                .split("_")
-                            )
-
-                        if formatted_output == "None":
-                            formatted_output = None
-
-                        parsed_variant_data[value] = formatted_output
-
-                match = re.search(
-                    r"(?P<gm_number>GM[0-9]{2}_[0-9]+)|(?P<sp_number>SP[0-9]{5}R[0-9]{4})|(?P<gmnumber>GM[0-9]{2}[0-9]+)", report, re.IGNORECASE
-                )
-                
-                if match:
-                    gm_number = match.group("gm_number")
-                    gmnumber = match.group("gmnumber")
-                    sp_number = match.group("sp_number")
-                    if gm_number:
-                        gm_number = gm_number.replace("_", ".")
-                        sample_data = sample_as_key.get(gm_number.upper(), None)
-                        parsed_variant_data["specimen_id"] = gm_number.upper()
-                    elif gmnumber:
-                        gmnumber = gmnumber[:4] + "." + gmnumber[4:]
-                        sample_data = sample_as_key.get(gmnumber.upper(), None)
-                        parsed_variant_data["specimen_id"] = gmnumber.upper()
-                    elif sp_number:
-                        sample_data = sample_as_key.get(sp_number.upper(), None)
-                        parsed_variant_data["specimen_id"] = sp_number.upper()
-                    else:
-                        sample_data = None
-                        parsed_variant_data["specimen_id"] = None
-
-                    if sample_data:
-                        r_codes = sample_data.get("r_code", None)
-                        panels = ", ".join(
-                            [
-                                panel.strip("_")
-                                for panel in sample_data["Panels"]
-                            ]
-                        )
-
-                        if sample_data.get("panel_name"):
-                            parsed_variant_data["preferred_condition_name"] = (
-                                ", ".join(sample_data["panel_name"])
-                            )
-
-                        if r_codes:
-                            parsed_variant_data["r_code"] = ", ".join(r_codes)
-
-                        parsed_variant_data["panel"] = panels
-
-                    else:
-                        parsed_variant_data["panel"] = (
-                            "Sample not in Medicover data"
-                        )
-
-                unique_id = f"uid_{uuid.uuid1().time}"
-                parsed_variant_data["local_id"] = unique_id
-                parsed_variant_data["linking_id"] = unique_id
-                parsed_variant_data["institution"] = (
-                    "East Genomic Laboratory Hub, NHS Genomic Medicine Service"
-                )
-                parsed_variant_data["organisation"] = (
-                    "Cambridge Genomics Laboratory"
-                )
-                parsed_variant_data["organisation_id"] = 288359
-                parsed_variant_data["collection_method"] = "clinical testing"
-                parsed_variant_data["allele_origin"] = "germline"
-                parsed_variant_data["affected_status"] = "yes"
-                parsed_variant_data["interpreted"] = "yes"
-                parsed_variant_data["probeset_id"] = "Medicover TWE"
-
-                data_to_import.append(parsed_variant_data)
-
-        print(f"{i}/{nb_reports} reports have been processed")
-
-    print(f"Skipped {skipped_reports} empty reports")
-    print(f"{no_variants} reports had no variants included")
-
-    # Remove duplicates (same sampleID, pos, ref, alt), keeping the most recent interpretation
-    import_df = pd.DataFrame(data_to_import)
-    import_df.sort_values(by="date_last_evaluated", inplace=True)
-    import_df.drop_duplicates(
-        subset=[
-        "specimen_id",
-        "chromosome",
-        "start",
-        "reference_allele",
-        "alternate_allele",
-        ],
-        keep="last",
-        inplace=True
+        matched_panels = set(always_matched_panels)
+
+        if panel_words:
+            # panels are separated by a character that can't be in the words
+            # so that matches can't span two panels
+            joined_panels = "\n".join(entry["Panels"])
+            last_panel_start = len(joined_panels) - len(entry["Panels"][-1])
+
+            for end, (length, hits) in automaton.iter(joined_panels):
+                in_last_panel = end - length + 1 >= last_panel_start
+
+                # the panel name can be in any of the panels of the sample
+                # but the disorders are only matched against the last one
+                for i, is_panel_name in hits:
+                    if is_panel_name or in_last_panel:
+                        matched_panels.add(i)
+
+        for i in matched_panels:
+            panel_name, _, r_code_info = panelapp_panels[i]
+            entry["r_code"].add(r_code_info)
+            entry["panel_name"].add(panel_name)
+
+    rows = iter_rows(reports, mapping_json_keys, sample_as_key, jobs)
+    # remove duplicates (same sampleID, pos, ref, alt), keeping the most
+    # recent interpretation, while the rows are being generated
+    data_to_import = utils.keep_most_recent(
+        rows, DUPLICATE_KEYS, "date_last_evaluated"
     )
-    # replace NaN with None to avoid DB weirdness
-    import_df = import_df.replace({float('nan'): None})
-
-    # Convert dataframe back to list of dicts
-    data_to_import = import_df.to_dict('records')
 
-    correct_data_to_import = utils.add_missing_keys(data_to_import)
+    # columnar data for the dump and the import, the fields missing from
+    # some variants are filled with nulls
+    import_df = pl.DataFrame(data_to_import, infer_schema_length=None)
 
     if write:
-        with open("json_dump_ready_for_import.json", "w") as f:
-            json.dump(correct_data_to_import, f, indent=2)
+        # one JSON object per line so that the dump doesn't have to be
+        # serialised or loaded in one go
+        import_df.write_ndjson("json_dump_ready_for_import.ndjson")
 
     if db_import:
-        db.insert_in_db(session, inca_table, correct_data_to_import)
+        db.insert_in_db(session, inca_table, import_df)
 
 
 if __name__ == "__main__":
@@ -641,6 +1306,16 @@ if __name__ == "__main__":
         "--dump",
         help="Dump of data to import, bypasses all the processing to do only the import",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help=(
+            "Number of processes parsing the reports, number of CPUs by "
+            "default"
+        ),
+    )
 
     args = parser.parse_args()
     main(
@@ -653,4 +1328,5 @@ if __name__ == "__main__":
         args.write,
         args.db,
         args.dump,
+        args.jobs,
     )